@@ -3,9 +3,22 @@ import os
 
 DB_PATH = "app/data/scraper.db"
 
+# Jobs in these states are still owned by a worker and never touched by
+# retention or bulk deletes.
+ACTIVE_STATUSES = ("pending", "running", "retrying")
+
 
 async def init_db():
     async with aiosqlite.connect(DB_PATH) as db:
+        # Incremental auto-vacuum lets retention hand freed pages back to the
+        # OS in small steps. Switching an existing database over requires one
+        # full VACUUM; WAL keeps readers unblocked while retention writes.
+        cursor = await db.execute("PRAGMA auto_vacuum")
+        if (await cursor.fetchone())[0] != 2:
+            await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            await db.execute("VACUUM")
+        await db.execute("PRAGMA journal_mode = WAL")
+
         await db.execute("""
             CREATE TABLE IF NOT EXISTS jobs (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -26,26 +39,170 @@ async def init_db():
             )
             await db.commit()
 
+        # Migration: add compacted flag for retention summaries
+        if "compacted" not in columns:
+            await db.execute(
+                "ALTER TABLE jobs ADD COLUMN compacted INTEGER NOT NULL DEFAULT 0"
+            )
+            await db.commit()
+
+        # Migration: retry bookkeeping (selector is kept so retries can rerun it)
+        for column, ddl in (
+            ("selector", "selector TEXT"),
+            ("attempts", "attempts INTEGER NOT NULL DEFAULT 0"),
+            ("next_attempt_at", "next_attempt_at TIMESTAMP"),
+            ("error_class", "error_class TEXT"),
+            ("budget_started_at", "budget_started_at TIMESTAMP"),
+        ):
+            if column not in columns:
+                await db.execute(f"ALTER TABLE jobs ADD COLUMN {ddl}")
+        await db.commit()
+
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_url ON jobs (url, id)")
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_jobs_retry ON jobs (status, next_attempt_at)"
+        )
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs (created_at)"
+        )
+        await db.commit()
+
 
-async def create_job(url: str):
+async def create_job(url: str, selector: str = None):
     async with aiosqlite.connect(DB_PATH) as db:
         cursor = await db.execute(
-            "INSERT INTO jobs (url, status, data) VALUES (?, ?, ?)",
-            (url, "pending", None),
+            "INSERT INTO jobs (url, status, data, selector) VALUES (?, ?, ?, ?)",
+            (url, "pending", None, selector),
         )
         await db.commit()
         return cursor.lastrowid
 
 
-async def update_job(job_id: int, status: str, data: str = None):
+async def update_job(job_id: int, status: str, data: str = None, error_class: str = None):
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute(
+            """
+            UPDATE jobs SET status = ?, data = ?, error_class = ?, next_attempt_at = NULL
+            WHERE id = ?
+            """,
+            (status, data, error_class, job_id),
+        )
+        await db.commit()
+
+
+async def start_job_attempt(job_id: int) -> tuple[int, float | None]:
+    """Mark a job running; return (attempt number, budget start as epoch).
+
+    The time budget starts with the first attempt that gets a host slot, so
+    time parked behind a busy host beforehand does not count.
+    """
+    async with aiosqlite.connect(DB_PATH) as db:
+        cursor = await db.execute(
+            """
+            UPDATE jobs
+            SET status = 'running', data = NULL, attempts = attempts + 1,
+                next_attempt_at = NULL,
+                budget_started_at = COALESCE(budget_started_at, CURRENT_TIMESTAMP)
+            WHERE id = ?
+            RETURNING attempts, CAST(strftime('%s', budget_started_at) AS INTEGER)
+            """,
+            (job_id,),
+        )
+        row = await cursor.fetchone()
+        await db.commit()
+        return (row[0], row[1]) if row else (1, None)
+
+
+async def schedule_retry(job_id: int, delay_seconds: float, data: str, error_class: str):
+    """Park a failed attempt in the queue until its backoff has elapsed."""
     async with aiosqlite.connect(DB_PATH) as db:
         await db.execute(
-            "UPDATE jobs SET status = ?, data = ? WHERE id = ?",
-            (status, data, job_id),
+            """
+            UPDATE jobs
+            SET status = 'retrying', data = ?, error_class = ?,
+                next_attempt_at = datetime('now', ?)
+            WHERE id = ?
+            """,
+            (data, error_class, f"+{delay_seconds:.0f} seconds", job_id),
         )
         await db.commit()
 
 
+async def defer_job(job_id: int, delay_seconds: float):
+    """Park a job whose host is busy; unlike a retry, no attempt is used."""
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.execute(
+            """
+            UPDATE jobs SET status = 'retrying', next_attempt_at = datetime('now', ?)
+            WHERE id = ?
+            """,
+            (f"+{delay_seconds:.0f} seconds", job_id),
+        )
+        await db.commit()
+
+
+async def claim_due_retries(limit: int) -> list[dict]:
+    """Move due `retrying` jobs back to `pending` and return them."""
+    async with aiosqlite.connect(DB_PATH) as db:
+        db.row_factory = aiosqlite.Row
+        cursor = await db.execute(
+            """
+            UPDATE jobs SET status = 'pending'
+            WHERE id IN (
+                SELECT id FROM jobs
+                WHERE status = 'retrying' AND next_attempt_at <= datetime('now')
+                ORDER BY next_attempt_at LIMIT ?
+            )
+            RETURNING id, url, selector
+            """,
+            (limit,),
+        )
+        rows = [dict(row) for row in await cursor.fetchall()]
+        await db.commit()
+        return rows
+
+
+async def requeue_interrupted_jobs() -> int:
+    """Queue jobs left `pending`/`running` by a previous process for retry now.
+
+    Workers are threads of the server process, so at startup nothing can
+    still be working on them; the retry dispatcher picks them up. The cut-off
+    attempt is not counted and the budget restarts with the resumed attempt,
+    so downtime can't fail the job.
+    """
+    async with aiosqlite.connect(DB_PATH) as db:
+        cursor = await db.execute(
+            """
+            UPDATE jobs
+            SET status = 'retrying', next_attempt_at = datetime('now'),
+                budget_started_at = NULL,
+                attempts = CASE WHEN status = 'running' THEN MAX(attempts - 1, 0) ELSE attempts END
+            WHERE status IN ('pending', 'running')
+            """
+        )
+        await db.commit()
+        return cursor.rowcount
+
+
+async def get_failure_stats() -> list[dict]:
+    """Failed and retrying job counts grouped by error class."""
+    async with aiosqlite.connect(DB_PATH) as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute(
+            """
+            SELECT COALESCE(error_class, 'unknown') AS error_class,
+                   SUM(status = 'failed') AS failed,
+                   SUM(status = 'retrying') AS retrying,
+                   ROUND(AVG(attempts), 2) AS avg_attempts
+            FROM jobs
+            WHERE status IN ('failed', 'retrying')
+            GROUP BY 1
+            ORDER BY failed DESC
+            """
+        ) as cursor:
+            return [dict(row) for row in await cursor.fetchall()]
+
+
 async def get_jobs():
     async with aiosqlite.connect(DB_PATH) as db:
         db.row_factory = aiosqlite.Row
@@ -71,3 +228,152 @@ async def delete_job(job_id: int) -> bool:
         cursor = await db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
         await db.commit()
         return cursor.rowcount > 0
+
+
+def _age_modifier(seconds: float) -> str:
+    """SQLite datetime() modifier for a point `seconds` in the past."""
+    return f"-{int(seconds)} seconds"
+
+
+async def find_job_ids(
+    limit: int,
+    ids: list[int] = None,
+    url: str = None,
+    status: str = None,
+    older_than_seconds: float = None,
+) -> list[int]:
+    """Return up to `limit` finished job ids matching every given filter."""
+    clauses = [f"status NOT IN ({','.join('?' * len(ACTIVE_STATUSES))})"]
+    params = list(ACTIVE_STATUSES)
+    if ids is not None:
+        clauses.append(f"id IN ({','.join('?' * len(ids))})")
+        params.extend(ids)
+    if url is not None:
+        clauses.append("url = ?")
+        params.append(url)
+    if status is not None:
+        clauses.append("status = ?")
+        params.append(status)
+    if older_than_seconds is not None:
+        clauses.append("created_at < datetime('now', ?)")
+        params.append(_age_modifier(older_than_seconds))
+    where = " AND ".join(clauses)
+
+    async with aiosqlite.connect(DB_PATH) as db:
+        async with db.execute(
+            f"SELECT id FROM jobs WHERE {where} ORDER BY id LIMIT ?",
+            (*params, limit),
+        ) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+
+async def find_expired_job_ids(ttl_seconds: float, limit: int) -> list[int]:
+    """Return finished jobs created more than `ttl_seconds` ago."""
+    async with aiosqlite.connect(DB_PATH) as db:
+        async with db.execute(
+            f"""
+            SELECT id FROM jobs
+            WHERE created_at < datetime('now', ?)
+              AND status NOT IN ({','.join('?' * len(ACTIVE_STATUSES))})
+            ORDER BY id LIMIT ?
+            """,
+            (_age_modifier(ttl_seconds), *ACTIVE_STATUSES, limit),
+        ) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+
+async def find_url_cutoffs(keep_per_url: int) -> list[tuple[str, int, int | None]]:
+    """Return (url, cutoff id, newest completed id) for URLs with surplus jobs.
+
+    Only finished (completed or failed) jobs are ranked; the cutoff is the id
+    of the URL's `keep_per_url`-th newest one.
+    """
+    async with aiosqlite.connect(DB_PATH) as db:
+        async with db.execute(
+            f"""
+            SELECT url, id, last_completed FROM (
+                SELECT url, id,
+                       ROW_NUMBER() OVER (PARTITION BY url ORDER BY id DESC) AS rank,
+                       COUNT(*) OVER (PARTITION BY url) AS total,
+                       MAX(CASE WHEN status = 'completed' THEN id END)
+                           OVER (PARTITION BY url) AS last_completed
+                FROM jobs
+                WHERE status NOT IN ({','.join('?' * len(ACTIVE_STATUSES))})
+            )
+            WHERE rank = ? AND total > ?
+            """,
+            (*ACTIVE_STATUSES, keep_per_url, keep_per_url),
+        ) as cursor:
+            return [tuple(row) for row in await cursor.fetchall()]
+
+
+async def find_surplus_job_ids(url: str, cutoff_id: int, limit: int, keep_id: int = None) -> list[int]:
+    """Return finished jobs for `url` older than `cutoff_id`, except `keep_id`."""
+    async with aiosqlite.connect(DB_PATH) as db:
+        async with db.execute(
+            f"""
+            SELECT id FROM jobs
+            WHERE url = ? AND id < ? AND id IS NOT ?
+              AND status NOT IN ({','.join('?' * len(ACTIVE_STATUSES))})
+            ORDER BY id LIMIT ?
+            """,
+            (url, cutoff_id, keep_id, *ACTIVE_STATUSES, limit),
+        ) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+
+async def find_compactable_jobs(age_seconds: float, limit: int) -> list[dict]:
+    """Return completed, not yet compacted jobs older than `age_seconds`."""
+    async with aiosqlite.connect(DB_PATH) as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute(
+            """
+            SELECT id, data FROM jobs
+            WHERE compacted = 0 AND status = 'completed'
+              AND created_at < datetime('now', ?)
+            ORDER BY id LIMIT ?
+            """,
+            (_age_modifier(age_seconds), limit),
+        ) as cursor:
+            return [dict(row) for row in await cursor.fetchall()]
+
+
+async def get_jobs_by_ids(ids: list[int]) -> list[dict]:
+    async with aiosqlite.connect(DB_PATH) as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute(
+            f"SELECT * FROM jobs WHERE id IN ({','.join('?' * len(ids))}) ORDER BY id",
+            ids,
+        ) as cursor:
+            return [dict(row) for row in await cursor.fetchall()]
+
+
+async def delete_jobs_by_ids(ids: list[int]) -> int:
+    async with aiosqlite.connect(DB_PATH) as db:
+        cursor = await db.execute(
+            f"DELETE FROM jobs WHERE id IN ({','.join('?' * len(ids))})", ids
+        )
+        await db.commit()
+        return cursor.rowcount
+
+
+async def compact_jobs(summaries: dict[int, str]) -> int:
+    """Replace job data with summary JSON and mark the rows compacted."""
+    async with aiosqlite.connect(DB_PATH) as db:
+        await db.executemany(
+            "UPDATE jobs SET data = ?, compacted = 1 WHERE id = ?",
+            [(data, job_id) for job_id, data in summaries.items()],
+        )
+        await db.commit()
+        return len(summaries)
+
+
+async def incremental_vacuum(max_pages: int) -> int:
+    """Release up to `max_pages` free pages to the OS; return pages left."""
+    async with aiosqlite.connect(DB_PATH) as db:
+        # incremental_vacuum frees one page per step, so drain the cursor
+        cursor = await db.execute(f"PRAGMA incremental_vacuum({int(max_pages)})")
+        await cursor.fetchall()
+        await db.commit()
+        cursor = await db.execute("PRAGMA freelist_count")
+        return (await cursor.fetchone())[0]
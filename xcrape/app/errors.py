@@ -0,0 +1,48 @@
+"""Exceptions raised while scraping, shared by politeness and retry logic."""
+import asyncio
+
+
+class RobotsDisallowed(Exception):
+    """The URL is disallowed by the host's robots.txt."""
+
+
+class HostUnavailable(Exception):
+    """The host's circuit breaker is open after repeated failures."""
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class HostNotReady(Exception):
+    """No politeness slot is free for the host yet (non-waiting acquire)."""
+
+    def __init__(self, host: str, retry_after: float):
+        super().__init__(f"Host {host} not ready; retry in {retry_after:.2f}s")
+        self.retry_after = retry_after
+
+
+class HttpError(Exception):
+    """The page answered with an HTTP error status."""
+
+    def __init__(self, status: int, message: str = None):
+        super().__init__(message or f"HTTP {status} from host")
+        self.status = status
+
+
+class HostThrottled(HttpError):
+    """The host answered with 429/503."""
+
+    def __init__(self, status: int, retry_after: float = None):
+        super().__init__(status, f"HTTP {status} from host (throttled)")
+        self.retry_after = retry_after
+
+
+class BudgetExceeded(Exception):
+    """The job ran out of its overall time budget."""
+
+
+def is_timeout_error(exc: BaseException) -> bool:
+    """True for builtin, asyncio and Playwright timeouts."""
+    # Playwright's TimeoutError does not subclass the builtin one
+    return isinstance(exc, (TimeoutError, asyncio.TimeoutError)) or "Timeout" in type(exc).__name__
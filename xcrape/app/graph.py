@@ -0,0 +1,373 @@
+"""Cross-job link graph: interned URLs and deduplicated edges.
+
+Every completed job replaces the outbound edges of its page, so the graph
+always reflects the latest scrape of each page. Queries run against the
+`urls`/`links` tables and their indexes, never against job data blobs.
+
+A rebuild fills `urls_new`/`links_new` and swaps them in, so queries and
+live indexing keep using the current graph until it is replaced.
+"""
+import json
+from urllib.parse import urldefrag, urlparse
+
+import aiosqlite
+
+from .db import DB_PATH
+
+# Max SQL variables per IN (...) clause
+CHUNK_SIZE = 500
+MAX_NEIGHBORHOOD_HOPS = 5
+REBUILD_BATCH_SIZE = 100
+# Tables a rebuild fills before they replace the live ones
+REBUILD_SUFFIX = "_new"
+
+
+async def _create_tables(db, suffix: str = ""):
+    await db.execute(f"""
+        CREATE TABLE IF NOT EXISTS urls{suffix} (
+            id INTEGER PRIMARY KEY,
+            url TEXT NOT NULL UNIQUE,
+            host TEXT NOT NULL,
+            last_job_id INTEGER,
+            last_status TEXT,
+            error_class TEXT,
+            crawled_at TIMESTAMP
+        )
+    """)
+    # Clustered on (src, dst) for outbound lookups; the covering dst index
+    # serves inbound, orphan and broken-link queries.
+    await db.execute(f"""
+        CREATE TABLE IF NOT EXISTS links{suffix} (
+            src_id INTEGER NOT NULL,
+            dst_id INTEGER NOT NULL,
+            internal INTEGER NOT NULL,
+            PRIMARY KEY (src_id, dst_id)
+        ) WITHOUT ROWID
+    """)
+
+
+async def _create_indexes(db):
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_links_dst ON links (dst_id, internal, src_id)"
+    )
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_urls_host ON urls (host)")
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_urls_failed ON urls (host) WHERE last_status = 'failed'"
+    )
+
+
+async def init_graph_db():
+    async with aiosqlite.connect(DB_PATH) as db:
+        await _create_tables(db)
+        await _create_indexes(db)
+        await db.commit()
+
+
+def _normalize(url: str) -> str:
+    """Canonical node key for a URL (fragment dropped)."""
+    return urldefrag(url.strip())[0]
+
+
+def _chunks(items: list, size: int = CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+async def _intern(db, urls: list[str], suffix: str = "") -> dict[str, int]:
+    """Return url -> id, inserting any URLs not yet in the table."""
+    await db.executemany(
+        f"INSERT OR IGNORE INTO urls{suffix} (url, host) VALUES (?, ?)",
+        [(u, urlparse(u).netloc.lower()) for u in urls],
+    )
+    ids = {}
+    for chunk in _chunks(urls):
+        async with db.execute(
+            f"SELECT url, id FROM urls{suffix} WHERE url IN ({','.join('?' * len(chunk))})", chunk
+        ) as cursor:
+            ids.update(await cursor.fetchall())
+    return ids
+
+
+async def _claim_page(
+    db, job_id: int, page: str, status: str, error_class: str = None, suffix: str = ""
+) -> int | None:
+    """Record the latest scrape of a page; None if a newer job already did."""
+    src_id = (await _intern(db, [page], suffix))[page]
+    cursor = await db.execute(
+        f"""
+        UPDATE urls{suffix}
+        SET last_job_id = ?, last_status = ?, error_class = ?, crawled_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND (last_job_id IS NULL OR last_job_id <= ?)
+        """,
+        (job_id, status, error_class, src_id, job_id),
+    )
+    return src_id if cursor.rowcount else None
+
+
+async def _index_links(db, job_id: int, url: str, links: list[dict], suffix: str = ""):
+    page = _normalize(url)
+    src_id = await _claim_page(db, job_id, page, "completed", suffix=suffix)
+    if src_id is None:
+        return
+
+    targets = {}
+    for link in links:
+        target = _normalize(link.get("url", ""))
+        if target.startswith(("http://", "https://")):
+            targets[target] = 1 if link.get("internal") else 0
+    ids = await _intern(db, list(targets), suffix)
+
+    await db.execute(f"DELETE FROM links{suffix} WHERE src_id = ?", (src_id,))
+    await db.executemany(
+        f"INSERT OR IGNORE INTO links{suffix} (src_id, dst_id, internal) VALUES (?, ?, ?)",
+        [(src_id, ids[t], internal) for t, internal in targets.items()],
+    )
+
+
+async def index_page_links(job_id: int, url: str, links: list[dict]):
+    """Replace the page's outbound edges with the links from this job."""
+    async with aiosqlite.connect(DB_PATH) as db:
+        await _index_links(db, job_id, url, links)
+        await db.commit()
+
+
+async def record_page_failure(job_id: int, url: str, error_class: str):
+    """Mark a page as failed so links pointing at it surface as broken."""
+    async with aiosqlite.connect(DB_PATH) as db:
+        await _claim_page(db, job_id, _normalize(url), "failed", error_class)
+        await db.commit()
+
+
+async def _merge_current_graph(db):
+    """Carry pages the rebuild has no newer job for over from the live tables.
+
+    Covers pages whose jobs were compacted or deleted and pages indexed by
+    scrapes that finished while the rebuild ran. Idempotent.
+    """
+    s = REBUILD_SUFFIX
+    await db.execute(f"INSERT OR IGNORE INTO urls{s} (url, host) SELECT url, host FROM urls")
+    await db.execute("DROP TABLE IF EXISTS temp.stale_pages")
+    await db.execute(f"""
+        CREATE TEMP TABLE stale_pages AS
+        SELECT o.id AS old_id, n.id AS new_id,
+               o.last_job_id, o.last_status, o.error_class, o.crawled_at
+        FROM urls o JOIN urls{s} n ON n.url = o.url
+        WHERE o.last_job_id IS NOT NULL
+          AND (n.last_job_id IS NULL OR n.last_job_id < o.last_job_id)
+    """)
+    await db.execute(f"""
+        UPDATE urls{s}
+        SET last_job_id = p.last_job_id, last_status = p.last_status,
+            error_class = p.error_class, crawled_at = p.crawled_at
+        FROM stale_pages p WHERE urls{s}.id = p.new_id
+    """)
+    await db.execute(f"DELETE FROM links{s} WHERE src_id IN (SELECT new_id FROM stale_pages)")
+    await db.execute(f"""
+        INSERT OR IGNORE INTO links{s} (src_id, dst_id, internal)
+        SELECT p.new_id, nd.id, l.internal FROM stale_pages p
+        JOIN links l ON l.src_id = p.old_id
+        JOIN urls od ON od.id = l.dst_id
+        JOIN urls{s} nd ON nd.url = od.url
+    """)
+    await db.execute("DROP TABLE temp.stale_pages")
+
+
+async def rebuild_link_graph() -> int:
+    """Re-index every job still holding full data; return jobs indexed.
+
+    The new graph is built beside the live one and swapped in with a single
+    transaction, so readers never see it half-built. Pages whose latest job
+    can no longer be re-indexed keep their current edges.
+    """
+    s = REBUILD_SUFFIX
+    indexed, last_id = 0, 0
+    async with aiosqlite.connect(DB_PATH) as db:
+        # Leftovers of an interrupted rebuild
+        await db.execute(f"DROP TABLE IF EXISTS links{s}")
+        await db.execute(f"DROP TABLE IF EXISTS urls{s}")
+        await _create_tables(db, s)
+        await db.commit()
+        while True:
+            async with db.execute(
+                """
+                SELECT id, url, status, data, error_class FROM jobs
+                WHERE id > ? AND status IN ('completed', 'failed') AND compacted = 0
+                ORDER BY id LIMIT ?
+                """,
+                (last_id, REBUILD_BATCH_SIZE),
+            ) as cursor:
+                rows = await cursor.fetchall()
+            if not rows:
+                break
+            for job_id, url, status, data, error_class in rows:
+                last_id = job_id
+                if status == "failed":
+                    await _claim_page(db, job_id, _normalize(url), "failed", error_class, s)
+                    continue
+                try:
+                    links = json.loads(data).get("links", [])
+                except (json.JSONDecodeError, TypeError, AttributeError):
+                    continue
+                await _index_links(db, job_id, url, links, s)
+                indexed += 1
+            await db.commit()
+
+        # Bulk merge first, then again under the write lock for the pages
+        # indexed meanwhile, so the lock is held only briefly.
+        await _merge_current_graph(db)
+        await db.commit()
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            await _merge_current_graph(db)
+            await db.execute("DROP TABLE links")
+            await db.execute("DROP TABLE urls")
+            await db.execute(f"ALTER TABLE urls{s} RENAME TO urls")
+            await db.execute(f"ALTER TABLE links{s} RENAME TO links")
+            await _create_indexes(db)
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+    return indexed
+
+
+# ── Queries ─────────────────────────────────────────────────────────────────
+
+
+async def _url_id(db, url: str) -> int | None:
+    async with db.execute("SELECT id FROM urls WHERE url = ?", (_normalize(url),)) as cursor:
+        row = await cursor.fetchone()
+        return row[0] if row else None
+
+
+async def get_outbound_links(url: str, limit: int) -> list[dict] | None:
+    async with aiosqlite.connect(DB_PATH) as db:
+        db.row_factory = aiosqlite.Row
+        src_id = await _url_id(db, url)
+        if src_id is None:
+            return None
+        async with db.execute(
+            """
+            SELECT u.url, l.internal, u.last_status FROM links l
+            JOIN urls u ON u.id = l.dst_id
+            WHERE l.src_id = ? LIMIT ?
+            """,
+            (src_id, limit),
+        ) as cursor:
+            return [dict(row) for row in await cursor.fetchall()]
+
+
+async def get_inbound_links(url: str, limit: int) -> list[dict] | None:
+    async with aiosqlite.connect(DB_PATH) as db:
+        db.row_factory = aiosqlite.Row
+        dst_id = await _url_id(db, url)
+        if dst_id is None:
+            return None
+        async with db.execute(
+            """
+            SELECT u.url, l.internal FROM links l
+            JOIN urls u ON u.id = l.src_id
+            WHERE l.dst_id = ? LIMIT ?
+            """,
+            (dst_id, limit),
+        ) as cursor:
+            return [dict(row) for row in await cursor.fetchall()]
+
+
+async def get_orphan_pages(host: str = None, limit: int = 100) -> list[dict]:
+    """Scraped pages that no other page on the same host links to."""
+    async with aiosqlite.connect(DB_PATH) as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute(
+            f"""
+            SELECT u.url, u.crawled_at FROM urls u
+            WHERE u.last_job_id IS NOT NULL {"AND u.host = ?" if host else ""}
+              AND NOT EXISTS (
+                  SELECT 1 FROM links l
+                  WHERE l.dst_id = u.id AND l.internal = 1 AND l.src_id != u.id
+              )
+            ORDER BY u.id LIMIT ?
+            """,
+            (*([host.lower()] if host else []), limit),
+        ) as cursor:
+            return [dict(row) for row in await cursor.fetchall()]
+
+
+async def get_broken_links(host: str = None, limit: int = 100) -> list[dict]:
+    """Link targets whose last scrape failed, most-linked first."""
+    async with aiosqlite.connect(DB_PATH) as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute(
+            f"""
+            SELECT u.url, u.error_class, COUNT(*) AS inbound_count FROM urls u
+            JOIN links l ON l.dst_id = u.id
+            WHERE u.last_status = 'failed' {"AND u.host = ?" if host else ""}
+            GROUP BY u.id
+            ORDER BY inbound_count DESC LIMIT ?
+            """,
+            (*([host.lower()] if host else []), limit),
+        ) as cursor:
+            return [dict(row) for row in await cursor.fetchall()]
+
+
+async def get_neighborhood(url: str, hops: int, direction: str = "out", limit: int = 500) -> dict | None:
+    """Breadth-first N-hop neighborhood, expanded one indexed query per level."""
+    hops = max(1, min(hops, MAX_NEIGHBORHOOD_HOPS))
+    queries = []
+    if direction in ("out", "both"):
+        queries.append("SELECT src_id, dst_id FROM links WHERE src_id IN ({})")
+    if direction in ("in", "both"):
+        queries.append("SELECT src_id, dst_id FROM links WHERE dst_id IN ({})")
+
+    async with aiosqlite.connect(DB_PATH) as db:
+        start = await _url_id(db, url)
+        if start is None:
+            return None
+        depth = {start: 0}
+        edges = set()
+        frontier = [start]
+        for level in range(1, hops + 1):
+            next_frontier = []
+            for chunk in _chunks(frontier):
+                for query in queries:
+                    async with db.execute(
+                        query.format(",".join("?" * len(chunk))), chunk
+                    ) as cursor:
+                        for src, dst in await cursor.fetchall():
+                            edges.add((src, dst))
+                            for n in (src, dst):
+                                if n not in depth and len(depth) < limit:
+                                    depth[n] = level
+                                    next_frontier.append(n)
+            frontier = next_frontier
+            if not frontier or len(depth) >= limit:
+                break
+
+        names = {}
+        ids = list(depth)
+        for chunk in _chunks(ids):
+            async with db.execute(
+                f"SELECT id, url FROM urls WHERE id IN ({','.join('?' * len(chunk))})", chunk
+            ) as cursor:
+                names.update(await cursor.fetchall())
+
+    return {
+        "nodes": [{"url": names[n], "depth": d} for n, d in sorted(depth.items(), key=lambda x: x[1])],
+        "edges": [
+            {"source": names[s], "target": names[t]}
+            for s, t in edges if s in depth and t in depth
+        ],
+    }
+
+
+async def get_graph_stats() -> dict:
+    async with aiosqlite.connect(DB_PATH) as db:
+        async with db.execute(
+            """
+            SELECT (SELECT COUNT(*) FROM urls),
+                   (SELECT COUNT(*) FROM urls WHERE last_job_id IS NOT NULL),
+                   (SELECT COUNT(*) FROM links)
+            """
+        ) as cursor:
+            urls, pages, edges = await cursor.fetchone()
+    return {"urls": urls, "crawled_pages": pages, "edges": edges}
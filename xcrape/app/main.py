@@ -2,6 +2,7 @@ import asyncio
 import csv
 import io
 import json
+import logging
 import os
 import threading
 from contextlib import asynccontextmanager
@@ -13,14 +14,78 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 
-from .db import create_job, delete_job, get_job, get_jobs, init_db
+from .db import (
+    ACTIVE_STATUSES,
+    claim_due_retries,
+    create_job,
+    delete_job,
+    find_job_ids,
+    get_failure_stats,
+    get_job,
+    get_jobs,
+    init_db,
+    requeue_interrupted_jobs,
+)
+from .graph import (
+    get_broken_links,
+    get_graph_stats,
+    get_inbound_links,
+    get_neighborhood,
+    get_orphan_pages,
+    get_outbound_links,
+    init_graph_db,
+    rebuild_link_graph,
+)
+from .politeness import controller
+from .retention import (
+    purge_jobs,
+    reclaim_space,
+    retention_enabled,
+    retention_loop,
+    run_retention,
+)
 from .scraper import run_scraper
 
+logger = logging.getLogger(__name__)
+
+RETRY_POLL_SECONDS = 1.0
+
+
+def _start_worker(job_id: int, url: str, selector: Optional[str]):
+    """Run one scrape attempt on its own thread and event loop."""
+
+    def run_in_thread():
+        import sys
+        if sys.platform == "win32":
+            asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+        asyncio.run(run_scraper(job_id, url, selector))
+
+    threading.Thread(target=run_in_thread, daemon=True).start()
+
+
+async def retry_dispatch_loop():
+    """Hand `retrying` jobs whose backoff has elapsed back to workers."""
+    while True:
+        try:
+            for job in await claim_due_retries(limit=20):
+                _start_worker(job["id"], job["url"], job["selector"])
+        except Exception:
+            logger.exception("Retry dispatch failed; trying again next tick")
+        await asyncio.sleep(RETRY_POLL_SECONDS)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await init_db()
+    await init_graph_db()
+    if interrupted := await requeue_interrupted_jobs():
+        logger.info("Requeued %d jobs interrupted by the last shutdown", interrupted)
+    retry_task = asyncio.create_task(retry_dispatch_loop())
+    retention_task = asyncio.create_task(retention_loop()) if retention_enabled() else None
     yield
+    retry_task.cancel()
+    if retention_task:
+        retention_task.cancel()
 
 
 app = FastAPI(title="Smart Local Web Scraper", lifespan=lifespan)
@@ -54,23 +119,21 @@ class ScrapeRequest(BaseModel):
     selector: Optional[str] = None
 
 
+class BulkDeleteRequest(BaseModel):
+    ids: Optional[list[int]] = None
+    url: Optional[str] = None
+    status: Optional[str] = None
+    older_than_days: Optional[float] = None
+    archive: bool = False
+
+
 # ── API Routes ───────────────────────────────────────────────────────────────
 
 
 @app.post("/api/scrape")
 async def trigger_scrape(req: ScrapeRequest):
-    job_id = await create_job(req.url)
-
-    def run_in_thread(jid, url, selector):
-        import sys
-        if sys.platform == "win32":
-            asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
-        asyncio.run(run_scraper(jid, url, selector))
-
-    threading.Thread(
-        target=run_in_thread, args=(job_id, req.url, req.selector), daemon=True
-    ).start()
-
+    job_id = await create_job(req.url, req.selector)
+    _start_worker(job_id, req.url, req.selector)
     return {"message": "Job created", "job_id": job_id}
 
 
@@ -96,6 +159,34 @@ async def remove_job(job_id: int):
     return {"message": "Job deleted"}
 
 
+@app.post("/api/jobs/bulk-delete")
+async def bulk_delete_jobs(req: BulkDeleteRequest):
+    """Delete every job matching all given filters, in small batches."""
+    if req.ids is None and req.url is None and req.status is None and req.older_than_days is None:
+        return JSONResponse(status_code=400, content={"error": "At least one filter is required"})
+    if req.status in ACTIVE_STATUSES:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"Cannot bulk-delete {req.status} jobs; a worker still owns them"},
+        )
+
+    older_than = req.older_than_days * 86400 if req.older_than_days is not None else None
+    deleted = await purge_jobs(
+        lambda limit: find_job_ids(limit, req.ids, req.url, req.status, older_than),
+        req.archive,
+    )
+    if deleted:
+        await reclaim_space()
+    return {"message": "Jobs deleted", "deleted": deleted}
+
+
+@app.post("/api/retention/run")
+async def trigger_retention():
+    """Apply the configured retention policy immediately."""
+    result = await run_retention()
+    return {"message": "Retention complete", **result}
+
+
 @app.post("/api/jobs/{job_id}/rescrape")
 async def rescrape_job(job_id: int):
     """Re-scrape the same URL from an existing job."""
@@ -103,16 +194,74 @@ async def rescrape_job(job_id: int):
     if not job:
         return JSONResponse(status_code=404, content={"error": "Job not found"})
 
-    new_job_id = await create_job(job["url"])
+    new_job_id = await create_job(job["url"], job.get("selector"))
+    _start_worker(new_job_id, job["url"], job.get("selector"))
+    return {"message": "Re-scrape started", "job_id": new_job_id}
 
-    def run_in_thread(jid, url):
-        import sys
-        if sys.platform == "win32":
-            asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
-        asyncio.run(run_scraper(jid, url, None))
 
-    threading.Thread(target=run_in_thread, args=(new_job_id, job["url"]), daemon=True).start()
-    return {"message": "Re-scrape started", "job_id": new_job_id}
+@app.get("/api/stats/failures")
+async def failure_stats():
+    """Failed and retrying jobs broken down by error class."""
+    return {"failures": await get_failure_stats()}
+
+
+# ── Link Graph ───────────────────────────────────────────────────────────────
+
+
+@app.get("/api/graph/stats")
+async def graph_stats():
+    return await get_graph_stats()
+
+
+@app.get("/api/graph/outbound")
+async def graph_outbound(url: str, limit: int = 500):
+    links = await get_outbound_links(url, limit)
+    if links is None:
+        return JSONResponse(status_code=404, content={"error": "URL not in link graph"})
+    return {"url": url, "links": links}
+
+
+@app.get("/api/graph/inbound")
+async def graph_inbound(url: str, limit: int = 500):
+    links = await get_inbound_links(url, limit)
+    if links is None:
+        return JSONResponse(status_code=404, content={"error": "URL not in link graph"})
+    return {"url": url, "links": links}
+
+
+@app.get("/api/graph/orphans")
+async def graph_orphans(host: Optional[str] = None, limit: int = 100):
+    """Scraped pages with no inbound internal links."""
+    return {"pages": await get_orphan_pages(host, limit)}
+
+
+@app.get("/api/graph/broken")
+async def graph_broken(host: Optional[str] = None, limit: int = 100):
+    """Linked-to URLs whose last scrape failed."""
+    return {"links": await get_broken_links(host, limit)}
+
+
+@app.get("/api/graph/neighborhood")
+async def graph_neighborhood(url: str, hops: int = 2, direction: str = "out", limit: int = 500):
+    if direction not in ("out", "in", "both"):
+        return JSONResponse(status_code=400, content={"error": "direction must be out, in or both"})
+    graph = await get_neighborhood(url, hops, direction, limit)
+    if graph is None:
+        return JSONResponse(status_code=404, content={"error": "URL not in link graph"})
+    return graph
+
+
+@app.post("/api/graph/rebuild")
+async def graph_rebuild():
+    """Rebuild the link graph from all jobs that still hold link data."""
+    indexed = await rebuild_link_graph()
+    return {"message": "Link graph rebuilt", "jobs_indexed": indexed}
+
+
+@app.get("/api/hosts")
+async def list_hosts():
+    """Current politeness state (limits, delays, circuit) per host."""
+    return {"hosts": controller.snapshot()}
 
 
 @app.get("/api/jobs/{job_id}/images/download-all")
@@ -0,0 +1,316 @@
+"""Per-host politeness: cached robots.txt rules and adaptive throttling.
+
+Scrape jobs run on their own threads with their own event loops, so the
+shared state here is guarded by threading locks rather than asyncio ones.
+"""
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+from .errors import (
+    BudgetExceeded,
+    HostNotReady,
+    HostThrottled,
+    HostUnavailable,
+    HttpError,
+    RobotsDisallowed,
+    is_timeout_error,
+)
+
+RESPECT_ROBOTS = os.getenv("XCRAPE_RESPECT_ROBOTS", "true").lower() in ("1", "true", "yes")
+ROBOTS_USER_AGENT = "xcrape"
+ROBOTS_CACHE_SECONDS = 3600
+ROBOTS_TIMEOUT_SECONDS = 5
+
+HOST_MAX_CONCURRENCY = int(os.getenv("XCRAPE_HOST_MAX_CONCURRENCY", "4"))
+HOST_MIN_DELAY_SECONDS = float(os.getenv("XCRAPE_HOST_MIN_DELAY_SECONDS", "0"))
+HOST_MAX_DELAY_SECONDS = 60.0
+HOST_INITIAL_CONCURRENCY = 2.0
+DELAY_STEP_SECONDS = 0.25
+
+# Latency is navigation start to response. An average above LATENCY_FACTOR x
+# the host's baseline (its fastest response, drifting slowly towards recent
+# ones so a single fast outlier doesn't pin it) is a congestion signal.
+LATENCY_FACTOR = 3.0
+LATENCY_EWMA_ALPHA = 0.3
+BASELINE_DRIFT_ALPHA = 0.05
+
+# Consecutive failures before a host's circuit opens, and how long it stays
+# open (doubling on each failed probe).
+CIRCUIT_FAILURES = 3
+CIRCUIT_COOLDOWN_SECONDS = 30.0
+CIRCUIT_MAX_COOLDOWN_SECONDS = 600.0
+
+THROTTLE_STATUSES = (429, 503)
+
+
+def _host_of(url: str) -> str:
+    return urlparse(url).netloc.lower()
+
+
+def _parse_retry_after(value: str) -> float | None:
+    """Parse a Retry-After header given as seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# ── robots.txt ──────────────────────────────────────────────────────────────
+
+_robots_lock = threading.Lock()
+_robots_cache: dict[str, tuple[float, RobotFileParser]] = {}
+
+
+async def _fetch_robots(origin: str) -> RobotFileParser:
+    import httpx
+
+    parser = RobotFileParser(f"{origin}/robots.txt")
+    try:
+        async with httpx.AsyncClient(follow_redirects=True, timeout=ROBOTS_TIMEOUT_SECONDS) as client:
+            resp = await client.get(parser.url)
+    except Exception:
+        # Unreachable robots.txt: don't block, the scrape itself will fail if
+        # the host is really down.
+        parser.allow_all = True
+        return parser
+
+    # Same status handling as RobotFileParser.read()
+    if resp.status_code in (401, 403):
+        parser.disallow_all = True
+    elif resp.status_code >= 400:
+        parser.allow_all = True
+    else:
+        parser.parse(resp.text.splitlines())
+    return parser
+
+
+async def get_robots(url: str) -> RobotFileParser:
+    """Return the (cached) robots.txt parser for the URL's origin."""
+    parsed = urlparse(url)
+    origin = f"{parsed.scheme}://{parsed.netloc}"
+    now = time.monotonic()
+    with _robots_lock:
+        cached = _robots_cache.get(origin)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    parser = await _fetch_robots(origin)
+    parser.modified()
+    with _robots_lock:
+        _robots_cache[origin] = (now + ROBOTS_CACHE_SECONDS, parser)
+    return parser
+
+
+async def check_robots(url: str):
+    """Raise RobotsDisallowed if robots.txt forbids the URL; apply crawl-delay."""
+    if not RESPECT_ROBOTS:
+        return
+    parser = await get_robots(url)
+    if not parser.can_fetch(ROBOTS_USER_AGENT, url):
+        raise RobotsDisallowed(f"Disallowed by robots.txt: {url}")
+    delay = parser.crawl_delay(ROBOTS_USER_AGENT)
+    if delay:
+        controller.set_min_delay(_host_of(url), float(delay))
+
+
+# ── Adaptive host controller ────────────────────────────────────────────────
+
+
+class HostState:
+    def __init__(self):
+        self.limit = min(HOST_INITIAL_CONCURRENCY, float(HOST_MAX_CONCURRENCY))
+        self.in_flight = 0
+        self.min_delay = HOST_MIN_DELAY_SECONDS
+        self.delay = HOST_MIN_DELAY_SECONDS
+        self.next_start = 0.0
+        self.latency = None
+        self.baseline = None
+        self.failures = 0
+        self.open_until = 0.0
+        self.cooldown = CIRCUIT_COOLDOWN_SECONDS
+        self.counts = {"success": 0, "throttled": 0, "timeout": 0, "error": 0}
+
+    def as_dict(self, now: float) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "delay_seconds": round(self.delay, 2),
+            "latency_seconds": round(self.latency, 2) if self.latency is not None else None,
+            "circuit_open": self.open_until > now,
+            "consecutive_failures": self.failures,
+            **self.counts,
+        }
+
+
+class HostController:
+    """AIMD concurrency/rate control with circuit breaking, keyed by host.
+
+    Successes grow a host's concurrency additively and shrink its delay;
+    429/503, timeouts and latency spikes halve concurrency and back off the
+    delay. Repeated failures open the circuit so jobs fail fast instead of
+    tying up a worker on a dead host.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts: dict[str, HostState] = {}
+
+    def _state(self, host: str) -> HostState:
+        st = self._hosts.get(host)
+        if st is None:
+            st = self._hosts[host] = HostState()
+        return st
+
+    def set_min_delay(self, host: str, delay: float):
+        with self._lock:
+            st = self._state(host)
+            st.min_delay = min(max(delay, HOST_MIN_DELAY_SECONDS), HOST_MAX_DELAY_SECONDS)
+            st.delay = max(st.delay, st.min_delay)
+
+    def try_acquire(self, host: str) -> float:
+        """Take a slot and return 0, or return seconds to wait before retrying."""
+        now = time.monotonic()
+        with self._lock:
+            st = self._state(host)
+            if st.failures >= CIRCUIT_FAILURES:
+                if now < st.open_until:
+                    raise HostUnavailable(
+                        f"Host {host} is failing; retry in {st.open_until - now:.0f}s",
+                        retry_after=st.open_until - now,
+                    )
+                if st.in_flight:
+                    return 1.0  # half-open: one probe at a time
+            if st.in_flight >= max(1, int(st.limit)):
+                return 0.1
+            if now < st.next_start:
+                return st.next_start - now
+            st.in_flight += 1
+            st.next_start = now + st.delay
+            return 0
+
+    async def acquire(self, host: str, deadline: float = None):
+        """Wait for a slot; give up with BudgetExceeded past `deadline` (epoch)."""
+        while (wait := self.try_acquire(host)) > 0:
+            if deadline is not None and time.time() + wait >= deadline:
+                raise BudgetExceeded(f"Job time budget exhausted waiting for {host}")
+            await asyncio.sleep(min(wait, 1.0))
+
+    def release(self, host: str, outcome: str = None, latency: float = None, retry_after: float = None):
+        """Return a slot and adapt the host's limits to the outcome."""
+        now = time.monotonic()
+        with self._lock:
+            st = self._state(host)
+            st.in_flight = max(0, st.in_flight - 1)
+            if outcome is None:
+                return
+            st.counts[outcome] += 1
+
+            if outcome == "success":
+                st.failures = 0
+                st.cooldown = CIRCUIT_COOLDOWN_SECONDS
+                if latency is not None:
+                    if st.baseline is None or latency < st.baseline:
+                        st.baseline = latency
+                    else:
+                        st.baseline += BASELINE_DRIFT_ALPHA * (latency - st.baseline)
+                    st.latency = latency if st.latency is None else (
+                        LATENCY_EWMA_ALPHA * latency + (1 - LATENCY_EWMA_ALPHA) * st.latency
+                    )
+                if st.latency is not None and st.latency > st.baseline * LATENCY_FACTOR:
+                    st.limit = max(1.0, st.limit * 0.75)
+                else:
+                    st.limit = min(float(HOST_MAX_CONCURRENCY), st.limit + 1 / st.limit)
+                    st.delay = max(st.min_delay, st.delay - DELAY_STEP_SECONDS)
+                return
+
+            st.limit = max(1.0, st.limit / 2)
+            st.delay = min(HOST_MAX_DELAY_SECONDS, max(st.delay * 2, DELAY_STEP_SECONDS, retry_after or 0))
+            st.next_start = max(st.next_start, now + st.delay)
+            if outcome in ("timeout", "error"):
+                st.failures += 1
+                if st.failures >= CIRCUIT_FAILURES:
+                    st.open_until = now + st.cooldown
+                    st.cooldown = min(st.cooldown * 2, CIRCUIT_MAX_COOLDOWN_SECONDS)
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {host: st.as_dict(now) for host, st in self._hosts.items()}
+
+
+controller = HostController()
+
+
+def check_response(response):
+    """Raise HostThrottled/HttpError for a navigation response with an error status."""
+    if response is None or response.status < 400:
+        return
+    if response.status in THROTTLE_STATUSES:
+        raise HostThrottled(response.status, _parse_retry_after(response.headers.get("retry-after")))
+    raise HttpError(response.status)
+
+
+class HostSlot:
+    """Handle yielded by host_slot; the fetch marks when it contacts the host."""
+
+    def __init__(self):
+        self.navigation_started = None
+        self.latency = None
+
+    def start_navigation(self):
+        self.navigation_started = time.monotonic()
+
+    def response_received(self):
+        self.latency = time.monotonic() - self.navigation_started
+
+
+@asynccontextmanager
+async def host_slot(url: str, deadline: float = None, wait: bool = True):
+    """Hold a politeness slot for the URL's host while fetching it.
+
+    With `wait=False` no time is spent queueing for the host: HostNotReady
+    is raised instead, so the caller can reschedule the URL. Only fetches
+    that called `start_navigation()` feed the host's adaptive limits, so
+    local failures such as a browser that won't launch are not held
+    against the host.
+    """
+    await check_robots(url)
+    host = _host_of(url)
+    if wait:
+        await controller.acquire(host, deadline)
+    elif (retry_after := controller.try_acquire(host)) > 0:
+        raise HostNotReady(host, retry_after)
+    slot = HostSlot()
+    outcome, retry_after = None, None
+    try:
+        yield slot
+        outcome = "success"
+    except HostThrottled as e:
+        outcome, retry_after = "throttled", e.retry_after
+        raise
+    except HttpError as e:
+        # A 4xx is a healthy answer from the host; only 5xx counts against it
+        outcome = "error" if e.status >= 500 else "success"
+        raise
+    except BudgetExceeded:
+        raise
+    except Exception as e:
+        outcome = "timeout" if is_timeout_error(e) else "error"
+        raise
+    finally:
+        if slot.navigation_started is None:
+            controller.release(host)
+        else:
+            controller.release(host, outcome, slot.latency, retry_after)
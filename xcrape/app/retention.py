@@ -0,0 +1,157 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+
+from .db import (
+    compact_jobs,
+    delete_jobs_by_ids,
+    find_compactable_jobs,
+    find_expired_job_ids,
+    find_surplus_job_ids,
+    find_url_cutoffs,
+    get_jobs_by_ids,
+    incremental_vacuum,
+)
+
+logger = logging.getLogger(__name__)
+
+# Retention policy (0 disables a rule). Configured through the environment so
+# the server and any batch tooling share the same settings.
+RETENTION_KEEP_PER_URL = int(os.getenv("XCRAPE_RETENTION_KEEP_PER_URL", "0"))
+RETENTION_TTL_DAYS = float(os.getenv("XCRAPE_RETENTION_TTL_DAYS", "0"))
+RETENTION_COMPACT_AFTER_DAYS = float(os.getenv("XCRAPE_RETENTION_COMPACT_AFTER_DAYS", "0"))
+RETENTION_ARCHIVE = os.getenv("XCRAPE_RETENTION_ARCHIVE", "false").lower() in ("1", "true", "yes")
+RETENTION_INTERVAL_SECONDS = float(os.getenv("XCRAPE_RETENTION_INTERVAL_SECONDS", "3600"))
+RETENTION_BATCH_SIZE = int(os.getenv("XCRAPE_RETENTION_BATCH_SIZE", "200"))
+
+# Pause between batches so scraper writes can interleave with retention
+BATCH_PAUSE_SECONDS = 0.05
+VACUUM_STEP_PAGES = 256
+ARCHIVE_DIR = "app/data/archive"
+
+# Keys kept when a job is compacted down to its summary
+SUMMARY_KEYS = ("meta", "stats", "technologies")
+
+
+def retention_enabled() -> bool:
+    return bool(RETENTION_KEEP_PER_URL or RETENTION_TTL_DAYS or RETENTION_COMPACT_AFTER_DAYS)
+
+
+def _summarize(data: str) -> str:
+    """Reduce full job data to its summary keys."""
+    try:
+        parsed = json.loads(data)
+    except (json.JSONDecodeError, TypeError):
+        parsed = {}
+    summary = {k: parsed[k] for k in SUMMARY_KEYS if k in parsed}
+    summary["compacted"] = True
+    return json.dumps(summary)
+
+
+def _write_archive(rows: list[dict]):
+    """Append job rows as NDJSON to this month's gzip archive."""
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(ARCHIVE_DIR, f"jobs-{time.strftime('%Y-%m')}.ndjson.gz")
+    # Appending to a gzip file adds a new member; readers see one stream
+    with gzip.open(path, "at", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+
+
+async def purge_jobs(find, archive: bool = False) -> int:
+    """Delete jobs returned by `find(limit)` in small batches.
+
+    Each batch is its own short transaction, optionally archived first, so
+    concurrent writers only ever wait for one batch.
+    """
+    total = 0
+    while True:
+        ids = await find(RETENTION_BATCH_SIZE)
+        if not ids:
+            break
+        if archive:
+            rows = await get_jobs_by_ids(ids)
+            await asyncio.to_thread(_write_archive, rows)
+        deleted = await delete_jobs_by_ids(ids)
+        if not deleted:
+            break
+        total += deleted
+        await asyncio.sleep(BATCH_PAUSE_SECONDS)
+    return total
+
+
+async def _surplus_finder(keep_per_url: int):
+    """Build a `find(limit)` over finished jobs beyond the newest N per URL.
+
+    Failed scrapes count toward N, but the newest completed job of a URL is
+    always kept so a run of failures can't evict its last good result.
+    Cutoff ids are computed once per run; each batch then walks idx_jobs_url
+    for one URL at a time instead of re-ranking the whole table.
+    """
+    cutoffs = await find_url_cutoffs(keep_per_url)
+
+    async def find(limit: int) -> list[int]:
+        ids = []
+        while cutoffs and len(ids) < limit:
+            url, cutoff_id, keep_id = cutoffs[-1]
+            wanted = limit - len(ids)
+            batch = await find_surplus_job_ids(url, cutoff_id, wanted, keep_id)
+            ids.extend(batch)
+            if len(batch) < wanted:
+                cutoffs.pop()  # Nothing more to delete for this URL
+        return ids
+
+    return find
+
+
+async def compact_old_jobs(age_seconds: float) -> int:
+    """Strip completed jobs older than `age_seconds` down to summary stats."""
+    total = 0
+    while True:
+        rows = await find_compactable_jobs(age_seconds, RETENTION_BATCH_SIZE)
+        if not rows:
+            break
+        total += await compact_jobs({row["id"]: _summarize(row["data"]) for row in rows})
+        await asyncio.sleep(BATCH_PAUSE_SECONDS)
+    return total
+
+
+async def reclaim_space():
+    """Return free pages to the OS a few hundred at a time."""
+    while await incremental_vacuum(VACUUM_STEP_PAGES) > 0:
+        await asyncio.sleep(BATCH_PAUSE_SECONDS)
+
+
+async def run_retention() -> dict:
+    """Apply every configured retention rule once and reclaim freed space."""
+    result = {"expired": 0, "surplus": 0, "compacted": 0}
+    day = 86400
+
+    if RETENTION_TTL_DAYS:
+        ttl = RETENTION_TTL_DAYS * day
+        result["expired"] = await purge_jobs(
+            lambda limit: find_expired_job_ids(ttl, limit), RETENTION_ARCHIVE
+        )
+    if RETENTION_KEEP_PER_URL:
+        result["surplus"] = await purge_jobs(
+            await _surplus_finder(RETENTION_KEEP_PER_URL), RETENTION_ARCHIVE
+        )
+    if RETENTION_COMPACT_AFTER_DAYS:
+        result["compacted"] = await compact_old_jobs(RETENTION_COMPACT_AFTER_DAYS * day)
+
+    if any(result.values()):
+        await reclaim_space()
+    return result
+
+
+async def retention_loop():
+    """Background task: run retention every RETENTION_INTERVAL_SECONDS."""
+    while True:
+        try:
+            await run_retention()
+        except Exception:
+            logger.exception("Retention run failed")
+        await asyncio.sleep(RETENTION_INTERVAL_SECONDS)
@@ -0,0 +1,108 @@
+"""Error classification and per-class retry policies for scrape jobs.
+
+Retries are scheduled through the job queue (a `retrying` row with a
+`next_attempt_at`), never by sleeping inside a worker, and every job has an
+overall time budget measured from its creation.
+"""
+import os
+import random
+import time
+
+from .errors import (
+    BudgetExceeded,
+    HostThrottled,
+    HostUnavailable,
+    HttpError,
+    RobotsDisallowed,
+    is_timeout_error,
+)
+
+JOB_BUDGET_SECONDS = float(os.getenv("XCRAPE_JOB_BUDGET_SECONDS", "180"))
+MAX_RETRY_DELAY_SECONDS = 300.0
+
+# error class: (max attempts, base backoff seconds)
+RETRY_POLICIES = {
+    "dns": (2, 30.0),
+    "connection": (3, 5.0),
+    "timeout": (2, 10.0),
+    "aborted": (2, 5.0),
+    "throttled": (4, 15.0),
+    "http_5xx": (3, 10.0),
+    "circuit_open": (3, 30.0),
+    "http_4xx": (1, 0.0),
+    "tls": (1, 0.0),
+    "robots": (1, 0.0),
+    "budget": (1, 0.0),
+    "other": (1, 0.0),
+}
+
+# Chromium net:: error codes and Playwright messages, checked in order
+_MESSAGE_CLASSES = (
+    ("ERR_NAME_NOT_RESOLVED", "dns"),
+    ("ERR_NAME_RESOLUTION_FAILED", "dns"),
+    ("ERR_TIMED_OUT", "timeout"),
+    ("ERR_CONNECTION_TIMED_OUT", "timeout"),
+    ("ERR_CERT_", "tls"),
+    ("ERR_SSL_", "tls"),
+    ("ERR_CONNECTION_", "connection"),
+    ("ERR_EMPTY_RESPONSE", "connection"),
+    ("ERR_NETWORK_CHANGED", "connection"),
+    ("ERR_INTERNET_DISCONNECTED", "connection"),
+    ("ERR_ADDRESS_UNREACHABLE", "connection"),
+    ("ERR_ABORTED", "aborted"),
+    ("frame was detached", "aborted"),
+    ("Navigation interrupted", "aborted"),
+)
+
+
+def classify_error(exc: BaseException) -> str:
+    """Map a scrape exception to one of the RETRY_POLICIES classes."""
+    if isinstance(exc, HostThrottled):
+        return "throttled"
+    if isinstance(exc, HttpError):
+        return "http_5xx" if exc.status >= 500 else "http_4xx"
+    if isinstance(exc, HostUnavailable):
+        return "circuit_open"
+    if isinstance(exc, RobotsDisallowed):
+        return "robots"
+    if isinstance(exc, BudgetExceeded):
+        return "budget"
+
+    message = str(exc)
+    for marker, error_class in _MESSAGE_CLASSES:
+        if marker in message:
+            return error_class
+    if is_timeout_error(exc):
+        return "timeout"
+    return "other"
+
+
+def retry_delay(error_class: str, attempt: int, exc: BaseException = None, deadline: float = None) -> float | None:
+    """Seconds to wait before the next attempt, or None to give up.
+
+    Exponential backoff with equal jitter, raised to any server-provided
+    Retry-After, and refused if it would end past the job's deadline.
+    """
+    max_attempts, base = RETRY_POLICIES.get(error_class, RETRY_POLICIES["other"])
+    if attempt >= max_attempts:
+        return None
+
+    backoff = min(MAX_RETRY_DELAY_SECONDS, base * 2 ** (attempt - 1))
+    delay = backoff / 2 + random.uniform(0, backoff / 2)
+    retry_after = getattr(exc, "retry_after", None)
+    if retry_after:
+        delay = max(delay, min(retry_after, MAX_RETRY_DELAY_SECONDS))
+
+    if deadline is not None and time.time() + delay >= deadline:
+        return None
+    return delay
+
+
+def remaining_ms(deadline: float, cap_ms: float) -> float:
+    """Timeout for the next browser step: the cap, clipped to the budget."""
+    if deadline is None:
+        return cap_ms
+    remaining = (deadline - time.time()) * 1000
+    if remaining <= 0:
+        raise BudgetExceeded("Job time budget exhausted")
+    return min(cap_ms, remaining)
@@ -1,11 +1,36 @@
 import base64
 import json
+import logging
 import re
 import time
 from urllib.parse import urljoin, urlparse
 from playwright.async_api import async_playwright
 from bs4 import BeautifulSoup
-from .db import update_job
+from .db import defer_job, schedule_retry, start_job_attempt, update_job
+from .errors import BudgetExceeded, HostNotReady, is_timeout_error
+from .graph import index_page_links, record_page_failure
+from .politeness import check_response, host_slot
+from .retry import JOB_BUDGET_SECONDS, classify_error, remaining_ms, retry_delay
+
+logger = logging.getLogger(__name__)
+
+# Use a realistic User-Agent to avoid being blocked/reset by servers
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
+
+# Common browser headers
+EXTRA_HEADERS = {
+    "Accept-Language": "en-US,en;q=0.9",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8",
+    "Sec-Fetch-Site": "none",
+    "Sec-Fetch-Mode": "navigate",
+    "Sec-Fetch-User": "?1",
+    "Sec-Fetch-Dest": "document",
+}
+
+# Navigation: one goto until DOMContentLoaded, then a bounded wait for the
+# network to settle. Both are further clipped to the job's time budget.
+NAV_TIMEOUT_MS = 30000
+SETTLE_TIMEOUT_MS = 10000
 
 # Known social media domains
 SOCIAL_DOMAINS = {
@@ -164,236 +189,325 @@ def _extract_structured_data(soup: BeautifulSoup) -> list[dict]:
     return structured
 
 
-async def run_scraper(job_id: int, url: str, selector: str = None):
-    """Scrape a URL and extract comprehensive page data."""
-    start_time = time.time()
-    try:
-        await update_job(job_id, "running", None)
+def _extract_page_data(
+    content: str,
+    url: str,
+    final_url: str,
+    selector: str,
+    screenshot_b64: str,
+    elapsed: float,
+) -> dict:
+    """Parse rendered HTML into the full scrape result."""
+    soup = BeautifulSoup(content, "html.parser")
+    parsed_base = urlparse(url)
+
+    # --- Meta Information ---
+    title = soup.title.string.strip() if soup.title and soup.title.string else "No Title"
+
+    meta_tags = {}
+    for tag in soup.find_all("meta"):
+        name = tag.get("name") or tag.get("property") or tag.get("http-equiv")
+        content_val = tag.get("content")
+        if name and content_val:
+            meta_tags[name.lower()] = content_val
+
+    favicon = None
+    fav_link = soup.find("link", rel=lambda r: r and "icon" in r)
+    if fav_link and fav_link.get("href"):
+        favicon = urljoin(url, fav_link["href"])
+
+    canonical = None
+    canon_link = soup.find("link", rel="canonical")
+    if canon_link and canon_link.get("href"):
+        canonical = canon_link["href"]
+
+    # --- Headings ---
+    headings = []
+    for level in range(1, 7):
+        for h in soup.find_all(f"h{level}"):
+            text = h.get_text(strip=True)
+            if text:
+                headings.append({"level": level, "text": text[:200]})
+
+    # --- Links ---
+    all_links = []
+    internal_count = 0
+    external_count = 0
+    for a in soup.find_all("a", href=True):
+        href = a["href"].strip()
+        if not href or href.startswith(("#", "javascript:", "mailto:", "tel:")):
+            continue
+        full_url = urljoin(url, href)
+        link_text = a.get_text(strip=True)[:100] or "[no text]"
+        link_parsed = urlparse(full_url)
+        is_internal = link_parsed.netloc == parsed_base.netloc
+        if is_internal:
+            internal_count += 1
+        else:
+            external_count += 1
+        all_links.append({
+            "url": full_url,
+            "text": link_text,
+            "internal": is_internal,
+        })
 
-        screenshot_b64 = None
+    # --- Images ---
+    images = []
+    for img in soup.find_all("img"):
+        src = img.get("src") or img.get("data-src")
+        if src:
+            images.append({
+                "src": urljoin(url, src),
+                "alt": img.get("alt", "")[:150],
+                "width": img.get("width"),
+                "height": img.get("height"),
+            })
 
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            # Use a realistic User-Agent to avoid being blocked/reset by servers
-            user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
-            page = await browser.new_page(
-                viewport={"width": 1280, "height": 720},
-                user_agent=user_agent
-            )
-            
-            # Add common browser headers
-            await page.set_extra_http_headers({
-                "Accept-Language": "en-US,en;q=0.9",
-                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8",
-                "Sec-Fetch-Site": "none",
-                "Sec-Fetch-Mode": "navigate",
-                "Sec-Fetch-User": "?1",
-                "Sec-Fetch-Dest": "document",
+    # --- Tables ---
+    tables = []
+    for table in soup.find_all("table"):
+        rows_data = []
+        for row in table.find_all("tr")[:50]:
+            cells = []
+            for cell in row.find_all(["th", "td"]):
+                cells.append(cell.get_text(strip=True)[:200])
+            if cells:
+                rows_data.append(cells)
+        if rows_data:
+            tables.append(rows_data)
+
+    # --- Lists ---
+    lists = []
+    for lst in soup.find_all(["ul", "ol"]):
+        items = []
+        for li in lst.find_all("li", recursive=False)[:30]:
+            text = li.get_text(strip=True)[:200]
+            if text:
+                items.append(text)
+        if items:
+            lists.append({"type": lst.name, "items": items})
+    lists = lists[:20]
+
+    # --- Text Content ---
+    paragraphs = []
+    for p_tag in soup.find_all("p"):
+        text = p_tag.get_text(strip=True)
+        if text and len(text) > 20:
+            paragraphs.append(text[:500])
+    paragraphs = paragraphs[:50]
+
+    # --- Resource Counts ---
+    script_count = len(soup.find_all("script", src=True))
+    style_count = len(soup.find_all("link", rel="stylesheet"))
+    inline_script_count = len([s for s in soup.find_all("script") if not s.get("src")])
+
+    # --- Page Stats ---
+    full_text = soup.get_text()
+    word_count = len(full_text.split())
+    html_size = len(content)
+
+    # --- Selector Results ---
+    selector_results = None
+    if selector:
+        elements = soup.select(selector)
+        selector_results = []
+        for el in elements:
+            selector_results.append({
+                "tag": el.name,
+                "text": el.get_text(strip=True)[:500],
+                "html": str(el)[:1000],
             })
 
-            # Navigate with timeout handling
-            try:
-                await page.goto(url, wait_until="networkidle", timeout=30000)
-            except Exception as nav_error:
-                try:
-                    await page.goto(url, wait_until="domcontentloaded", timeout=15000)
-                except Exception:
-                    raise nav_error
+    # --- New: Technology Detection ---
+    technologies = _detect_technologies(soup, content)
+
+    # --- New: Social Links ---
+    social_links = _extract_social_links(all_links)
+
+    # --- New: Structured Data ---
+    structured_data = _extract_structured_data(soup)
+
+    # --- Build result ---
+    return {
+        "meta": {
+            "title": title,
+            "description": meta_tags.get("description", ""),
+            "keywords": meta_tags.get("keywords", ""),
+            "og_title": meta_tags.get("og:title", ""),
+            "og_description": meta_tags.get("og:description", ""),
+            "og_image": meta_tags.get("og:image", ""),
+            "favicon": favicon,
+            "canonical": canonical,
+            "final_url": final_url,
+        },
+        "headings": headings,
+        "links": all_links,
+        "images": images,
+        "tables": tables,
+        "lists": lists,
+        "text": paragraphs,
+        "selector_results": selector_results,
+        "technologies": technologies,
+        "social_links": social_links,
+        "structured_data": structured_data,
+        "screenshot": screenshot_b64,
+        "stats": {
+            "word_count": word_count,
+            "link_count": len(all_links),
+            "internal_links": internal_count,
+            "external_links": external_count,
+            "image_count": len(images),
+            "heading_count": len(headings),
+            "table_count": len(tables),
+            "list_count": len(lists),
+            "script_count": script_count,
+            "inline_script_count": inline_script_count,
+            "style_count": style_count,
+            "html_size_bytes": html_size,
+            "tech_count": len(technologies),
+            "social_count": len(social_links),
+            "structured_data_count": len(structured_data),
+            "load_time_seconds": elapsed,
+        },
+    }
+
+
+async def _render_page(
+    browser, url: str, selector: str, screenshot: bool, deadline: float, slot
+) -> dict:
+    """Load and extract a URL in a fresh page; the caller holds the host slot."""
+    start_time = time.time()
+    screenshot_b64 = None
 
-            # Capture screenshot
+    page = await browser.new_page(
+        viewport={"width": 1280, "height": 720},
+        user_agent=USER_AGENT,
+    )
+    try:
+        await page.set_extra_http_headers(EXTRA_HEADERS)
+
+        # A single navigation: a dead host fails once, and retries are
+        # left to the job queue rather than a second goto here.
+        nav_timeout = remaining_ms(deadline, NAV_TIMEOUT_MS)
+        slot.start_navigation()
+        try:
+            response = await page.goto(url, wait_until="domcontentloaded", timeout=nav_timeout)
+            slot.response_received()
+        except Exception as e:
+            # Timing out on a deadline-shortened wait is the job running
+            # out of budget, not the host being slow
+            if nav_timeout < NAV_TIMEOUT_MS and is_timeout_error(e):
+                raise BudgetExceeded("Job time budget exhausted during navigation") from e
+            raise
+        check_response(response)
+        try:
+            await page.wait_for_load_state(
+                "networkidle", timeout=remaining_ms(deadline, SETTLE_TIMEOUT_MS)
+            )
+        except Exception:
+            pass  # Pages that keep polling never go idle; use what rendered
+
+        # Capture screenshot
+        if screenshot:
             try:
                 screenshot_bytes = await page.screenshot(
-                    type="jpeg", quality=70, full_page=False
+                    type="jpeg", quality=70, full_page=False,
+                    timeout=remaining_ms(deadline, NAV_TIMEOUT_MS),
                 )
                 screenshot_b64 = base64.b64encode(screenshot_bytes).decode("ascii")
             except Exception:
                 pass  # Screenshot is non-critical
 
-            content = await page.content()
-            final_url = page.url
-            await browser.close()
-
-        elapsed = round(time.time() - start_time, 2)
-        soup = BeautifulSoup(content, "html.parser")
-        parsed_base = urlparse(url)
-
-        # --- Meta Information ---
-        title = soup.title.string.strip() if soup.title and soup.title.string else "No Title"
-
-        meta_tags = {}
-        for tag in soup.find_all("meta"):
-            name = tag.get("name") or tag.get("property") or tag.get("http-equiv")
-            content_val = tag.get("content")
-            if name and content_val:
-                meta_tags[name.lower()] = content_val
-
-        favicon = None
-        fav_link = soup.find("link", rel=lambda r: r and "icon" in r)
-        if fav_link and fav_link.get("href"):
-            favicon = urljoin(url, fav_link["href"])
-
-        canonical = None
-        canon_link = soup.find("link", rel="canonical")
-        if canon_link and canon_link.get("href"):
-            canonical = canon_link["href"]
-
-        # --- Headings ---
-        headings = []
-        for level in range(1, 7):
-            for h in soup.find_all(f"h{level}"):
-                text = h.get_text(strip=True)
-                if text:
-                    headings.append({"level": level, "text": text[:200]})
-
-        # --- Links ---
-        all_links = []
-        internal_count = 0
-        external_count = 0
-        for a in soup.find_all("a", href=True):
-            href = a["href"].strip()
-            if not href or href.startswith(("#", "javascript:", "mailto:", "tel:")):
-                continue
-            full_url = urljoin(url, href)
-            link_text = a.get_text(strip=True)[:100] or "[no text]"
-            link_parsed = urlparse(full_url)
-            is_internal = link_parsed.netloc == parsed_base.netloc
-            if is_internal:
-                internal_count += 1
-            else:
-                external_count += 1
-            all_links.append({
-                "url": full_url,
-                "text": link_text,
-                "internal": is_internal,
-            })
+        content = await page.content()
+        final_url = page.url
+    finally:
+        await page.close()
+
+    elapsed = round(time.time() - start_time, 2)
+    return _extract_page_data(content, url, final_url, selector, screenshot_b64, elapsed)
+
+
+async def scrape_page(
+    browser,
+    url: str,
+    selector: str = None,
+    screenshot: bool = True,
+    deadline: float = None,
+    wait_for_host: bool = True,
+) -> dict:
+    """Scrape a URL in a fresh page of an already-launched browser.
+
+    `deadline` is an epoch timestamp; every browser wait is clipped to it and
+    BudgetExceeded is raised once it has passed. With `wait_for_host=False`,
+    HostNotReady is raised instead of waiting for a politeness slot.
+    """
+    # host_slot applies robots.txt, per-host rate limits and circuit breaking
+    async with host_slot(url, deadline, wait_for_host) as slot:
+        return await _render_page(browser, url, selector, screenshot, deadline, slot)
+
+
+def build_error_data(exc: Exception, start_time: float, attempt: int = 1) -> dict:
+    """Structured error payload stored for failed scrapes."""
+    return {
+        "error": str(exc),
+        "error_type": type(exc).__name__,
+        "error_class": classify_error(exc),
+        "attempt": attempt,
+        "load_time_seconds": round(time.time() - start_time, 2),
+    }
+
+
+async def _start_attempt(job_id: int) -> tuple[int, float | None]:
+    """Mark the job running; return (attempt number, budget deadline)."""
+    attempt, budget_started_at = await start_job_attempt(job_id)
+    if budget_started_at is None:
+        return attempt, None
+    return attempt, budget_started_at + JOB_BUDGET_SECONDS
 
-        # --- Images ---
-        images = []
-        for img in soup.find_all("img"):
-            src = img.get("src") or img.get("data-src")
-            if src:
-                images.append({
-                    "src": urljoin(url, src),
-                    "alt": img.get("alt", "")[:150],
-                    "width": img.get("width"),
-                    "height": img.get("height"),
-                })
-
-        # --- Tables ---
-        tables = []
-        for table in soup.find_all("table"):
-            rows_data = []
-            for row in table.find_all("tr")[:50]:
-                cells = []
-                for cell in row.find_all(["th", "td"]):
-                    cells.append(cell.get_text(strip=True)[:200])
-                if cells:
-                    rows_data.append(cells)
-            if rows_data:
-                tables.append(rows_data)
-
-        # --- Lists ---
-        lists = []
-        for lst in soup.find_all(["ul", "ol"]):
-            items = []
-            for li in lst.find_all("li", recursive=False)[:30]:
-                text = li.get_text(strip=True)[:200]
-                if text:
-                    items.append(text)
-            if items:
-                lists.append({"type": lst.name, "items": items})
-        lists = lists[:20]
-
-        # --- Text Content ---
-        paragraphs = []
-        for p_tag in soup.find_all("p"):
-            text = p_tag.get_text(strip=True)
-            if text and len(text) > 20:
-                paragraphs.append(text[:500])
-        paragraphs = paragraphs[:50]
-
-        # --- Resource Counts ---
-        script_count = len(soup.find_all("script", src=True))
-        style_count = len(soup.find_all("link", rel="stylesheet"))
-        inline_script_count = len([s for s in soup.find_all("script") if not s.get("src")])
-
-        # --- Page Stats ---
-        full_text = soup.get_text()
-        word_count = len(full_text.split())
-        html_size = len(content)
-
-        # --- Selector Results ---
-        selector_results = None
-        if selector:
-            elements = soup.select(selector)
-            selector_results = []
-            for el in elements:
-                selector_results.append({
-                    "tag": el.name,
-                    "text": el.get_text(strip=True)[:500],
-                    "html": str(el)[:1000],
-                })
-
-        # --- New: Technology Detection ---
-        technologies = _detect_technologies(soup, content)
-
-        # --- New: Social Links ---
-        social_links = _extract_social_links(all_links)
-
-        # --- New: Structured Data ---
-        structured_data = _extract_structured_data(soup)
-
-        # --- Build result ---
-        extracted_data = {
-            "meta": {
-                "title": title,
-                "description": meta_tags.get("description", ""),
-                "keywords": meta_tags.get("keywords", ""),
-                "og_title": meta_tags.get("og:title", ""),
-                "og_description": meta_tags.get("og:description", ""),
-                "og_image": meta_tags.get("og:image", ""),
-                "favicon": favicon,
-                "canonical": canonical,
-                "final_url": final_url,
-            },
-            "headings": headings,
-            "links": all_links,
-            "images": images,
-            "tables": tables,
-            "lists": lists,
-            "text": paragraphs,
-            "selector_results": selector_results,
-            "technologies": technologies,
-            "social_links": social_links,
-            "structured_data": structured_data,
-            "screenshot": screenshot_b64,
-            "stats": {
-                "word_count": word_count,
-                "link_count": len(all_links),
-                "internal_links": internal_count,
-                "external_links": external_count,
-                "image_count": len(images),
-                "heading_count": len(headings),
-                "table_count": len(tables),
-                "list_count": len(lists),
-                "script_count": script_count,
-                "inline_script_count": inline_script_count,
-                "style_count": style_count,
-                "html_size_bytes": html_size,
-                "tech_count": len(technologies),
-                "social_count": len(social_links),
-                "structured_data_count": len(structured_data),
-                "load_time_seconds": elapsed,
-            },
-        }
+
+async def run_scraper(job_id: int, url: str, selector: str = None):
+    """Run one attempt of a job; on failure either requeue it or fail it.
+
+    The host slot is taken before anything else, without waiting: if the host
+    is busy the job is parked until it is ready, with no attempt used and no
+    browser launched.
+    """
+    start_time = time.time()
+    attempt, deadline = None, None
+    try:
+        async with host_slot(url, wait=False) as slot:
+            attempt, deadline = await _start_attempt(job_id)
+            async with async_playwright() as p:
+                browser = await p.chromium.launch(headless=True)
+                try:
+                    extracted_data = await _render_page(browser, url, selector, True, deadline, slot)
+                finally:
+                    await browser.close()
 
         await update_job(job_id, "completed", json.dumps(extracted_data))
+        try:
+            await index_page_links(job_id, url, extracted_data["links"])
+        except Exception:
+            # The job itself succeeded; /api/graph/rebuild re-derives its edges
+            # while the job still holds full data (i.e. until it is compacted)
+            logger.exception("Failed to index links of job %s", job_id)
+
+    except HostNotReady as e:
+        await defer_job(job_id, e.retry_after)
 
     except Exception as e:
-        elapsed = round(time.time() - start_time, 2)
-        error_data = json.dumps({
-            "error": str(e),
-            "error_type": type(e).__name__,
-            "load_time_seconds": elapsed,
-        })
-        await update_job(job_id, "failed", error_data)
+        if attempt is None:
+            # Refused before starting (robots.txt, open circuit): still an attempt
+            attempt, deadline = await _start_attempt(job_id)
+        error_data = build_error_data(e, start_time, attempt)
+        error_class = error_data["error_class"]
+        delay = retry_delay(error_class, attempt, e, deadline)
+        if delay is not None:
+            error_data["next_attempt_in_seconds"] = round(delay)
+            await schedule_retry(job_id, delay, json.dumps(error_data), error_class)
+        else:
+            await update_job(job_id, "failed", json.dumps(error_data), error_class)
+            try:
+                await record_page_failure(job_id, url, error_class)
+            except Exception:
+                logger.exception("Failed to record page failure of job %s", job_id)
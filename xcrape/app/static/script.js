@@ -88,9 +88,13 @@ document.addEventListener('DOMContentLoaded', () => {
 
             const running = allJobs.filter(j => j.status === 'running').length;
             const pending = allJobs.filter(j => j.status === 'pending').length;
+            const retrying = allJobs.filter(j => j.status === 'retrying').length;
             if (running > 0) {
                 footerStatus.textContent = `RUNNING (${running})`;
                 footerStatus.style.color = 'var(--status-running)';
+            } else if (retrying > 0) {
+                footerStatus.textContent = `RETRYING (${retrying})`;
+                footerStatus.style.color = 'var(--status-retrying)';
             } else if (pending > 0) {
                 footerStatus.textContent = `PENDING (${pending})`;
                 footerStatus.style.color = 'var(--status-pending)';
@@ -119,7 +123,7 @@ document.addEventListener('DOMContentLoaded', () => {
         jobsTableBody.innerHTML = '';
         jobs.forEach(job => {
             const tr = document.createElement('tr');
-            const hasData = job.status === 'completed' || (job.status === 'failed' && job.data);
+            const hasData = job.status === 'completed' || ((job.status === 'failed' || job.status === 'retrying') && job.data);
             if (hasData) tr.classList.add('clickable');
 
             const timeStr = job.created_at ? formatTime(job.created_at) : '—';
@@ -528,9 +532,10 @@ document.addEventListener('DOMContentLoaded', () => {
         tabBar.querySelectorAll('.tab').forEach(t => t.classList.remove('active'));
         tabContent.innerHTML = `
             <div class="error-display">
-                <div class="error-type">${escapeHtml(data.error_type || 'Error')}</div>
+                <div class="error-type">${escapeHtml(data.error_type || 'Error')}${data.error_class ? ` · ${escapeHtml(data.error_class)}` : ''}</div>
                 <div class="error-message">${escapeHtml(data.error || 'Unknown error')}</div>
                 ${data.load_time_seconds ? `<div style="margin-top: 0.5rem; color: var(--md-on-surface-variant); font-size: 0.78rem;">Failed after ${data.load_time_seconds}s</div>` : ''}
+                ${data.next_attempt_in_seconds !== undefined ? `<div style="margin-top: 0.25rem; color: var(--status-retrying); font-size: 0.78rem;">Attempt ${data.attempt} failed — retrying in ~${data.next_attempt_in_seconds}s</div>` : ''}
             </div>`;
     }
 
@@ -1,5 +1,170 @@
-def main():
-    print("Hello from xcrape!")
+"""Headless batch runner: scrape URLs and stream NDJSON results.
+
+    uv run main.py urls.txt -c 8 -o results.ndjson
+    cat urls.txt | uv run main.py --no-screenshot | jq .data.meta.title
+
+Playwright and the scraper are imported only once arguments are parsed so
+`--help` and argument errors stay fast. No database or server is involved.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="xcrape",
+        description="Scrape URLs (one per line) and write one NDJSON result per page.",
+    )
+    parser.add_argument(
+        "input", nargs="?", default="-", type=argparse.FileType("r", encoding="utf-8"),
+        help="file with one URL per line, or '-' for stdin (default)",
+    )
+    parser.add_argument(
+        "-o", "--output", default="-", type=argparse.FileType("w", encoding="utf-8"),
+        help="NDJSON output file, or '-' for stdout (default)",
+    )
+    parser.add_argument(
+        "-c", "--concurrency", type=int, default=4,
+        help="pages scraped in parallel with one shared browser (default: 4)",
+    )
+    parser.add_argument("-s", "--selector", help="optional CSS selector to extract")
+    parser.add_argument(
+        "--no-screenshot", action="store_true",
+        help="skip the base64 screenshot to keep output small",
+    )
+    parser.add_argument(
+        "--no-retry", action="store_true",
+        help="report the first failure instead of retrying transient errors",
+    )
+    parser.add_argument(
+        "--budget", type=float,
+        help="overall time budget per URL in seconds, retries included (default: 180)",
+    )
+    args = parser.parse_args(argv)
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.budget is not None and args.budget <= 0:
+        parser.error("--budget must be greater than 0")
+    return args
+
+
+async def run_batch(args) -> int:
+    """Scrape every input URL and return the number of failures."""
+    from playwright.async_api import async_playwright
+
+    from app.errors import HostNotReady
+    from app.retry import JOB_BUDGET_SECONDS, retry_delay
+    from app.scraper import build_error_data, scrape_page
+
+    # argparse opened both (stdin/stdout for '-'), so path errors surface early
+    infile, outfile = args.input, args.output
+    budget = args.budget if args.budget is not None else JOB_BUDGET_SECONDS
+    loop = asyncio.get_running_loop()
+    # Items are (url, attempt, deadline); None tells a worker to stop. The
+    # deadline is set when the first attempt starts, so time spent waiting
+    # for a busy host before that does not count against the budget.
+    queue = asyncio.Queue(maxsize=args.concurrency * 2)
+    counts = {"completed": 0, "failed": 0}
+    # URLs read but not yet written out, including those waiting to retry
+    state = {"outstanding": 0, "reading": True}
+    # Bound on outstanding URLs, so a slow host can't pull the whole input in
+    window = asyncio.Semaphore(args.concurrency * 8)
+    requeue_tasks = set()
+
+    def requeue(item):
+        task = loop.create_task(queue.put(item))
+        requeue_tasks.add(task)
+        task.add_done_callback(requeue_tasks.discard)
+
+    async def stop_if_done():
+        if not state["reading"] and state["outstanding"] == 0:
+            for _ in range(args.concurrency):
+                await queue.put(None)
+
+    async def read_urls():
+        """Feed URLs into the queue as they arrive."""
+        while line := await asyncio.to_thread(infile.readline):
+            url = line.strip()
+            if url and not url.startswith("#"):
+                await window.acquire()
+                state["outstanding"] += 1
+                await queue.put((url, 1, None))
+        state["reading"] = False
+        await stop_if_done()
+
+    async def worker(browser):
+        while (item := await queue.get()) is not None:
+            url, attempt, deadline = item
+            start_time = time.time()
+            try:
+                data = await scrape_page(
+                    browser, url, args.selector,
+                    screenshot=not args.no_screenshot,
+                    deadline=deadline or start_time + budget,
+                    wait_for_host=False,
+                )
+                status = "completed"
+            except HostNotReady as e:
+                # Host is at its limit or delay; hand the worker to another URL
+                loop.call_later(e.retry_after, requeue, item)
+                continue
+            except Exception as e:
+                deadline = deadline or start_time + budget
+                data = build_error_data(e, start_time, attempt)
+                status = "failed"
+                delay = None if args.no_retry else retry_delay(data["error_class"], attempt, e, deadline)
+                if delay is not None:
+                    # Requeue after the backoff instead of sleeping in the worker
+                    loop.call_later(delay, requeue, (url, attempt + 1, deadline))
+                    continue
+            counts[status] += 1
+            # Single-threaded event loop: each line is written whole
+            outfile.write(json.dumps({"url": url, "status": status, "data": data}) + "\n")
+            outfile.flush()
+            state["outstanding"] -= 1
+            window.release()
+            await stop_if_done()
+
+    try:
+        async with async_playwright() as p:
+            browser = await p.chromium.launch(headless=True)
+            try:
+                await asyncio.gather(
+                    read_urls(),
+                    *(worker(browser) for _ in range(args.concurrency)),
+                )
+            finally:
+                await browser.close()
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+        if outfile is not sys.stdout:
+            outfile.close()
+
+    print(
+        f"xcrape: {counts['completed']} completed, {counts['failed']} failed",
+        file=sys.stderr,
+    )
+    return counts["failed"]
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if sys.platform == "win32":
+        asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+    try:
+        failed = asyncio.run(run_batch(args))
+    except KeyboardInterrupt:
+        sys.exit(130)
+    except BrokenPipeError:
+        # Downstream closed the pipe (e.g. `| head`); silence the final flush
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(0)
+    sys.exit(1 if failed else 0)
 
 
 if __name__ == "__main__":